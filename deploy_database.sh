@@ -54,11 +54,14 @@ if [ ! -f "requirements.txt" ]; then
     cat > requirements.txt << 'EOF'
 Flask==3.0.0
 Flask-CORS==4.0.0
+Flask-Compress==1.15
 Flask-Limiter==3.5.0
 Flask-SQLAlchemy==3.1.1
 SQLAlchemy==2.0.23
 requests==2.31.0
 PyYAML==6.0.1
+orjson==3.10.7
+PyMuPDF==1.24.10
 PyPDF2==3.0.1
 pandas==2.1.4
 openpyxl==3.1.2
@@ -128,6 +131,11 @@ echo ""
 echo "   # For Gunicorn:"
 echo "   pkill gunicorn"
 echo "   gunicorn -c gunicorn_config.py genaiStudio_app:application"
+echo "   # (use threaded workers, e.g. worker_class = 'gthread', threads = 16,"
+echo "   #  so a slow GenAI response doesn't tie up a whole worker)"
+echo "   # Chat turns are committed just after the reply is sent, and only requests"
+echo "   # in the same worker wait for that commit: use workers = 1 with more"
+echo "   # threads if back-to-back messages must always see the previous reply."
 echo ""
 echo "3. ${YELLOW}Test the application:${NC}"
 echo "   - Open in browser"
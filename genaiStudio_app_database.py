@@ -10,53 +10,150 @@ import json
 import time
 import yaml
 import logging
+import sqlite3
+import threading
 from logging.handlers import RotatingFileHandler
 from datetime import datetime, timedelta
-import hashlib
+import secrets
 import mimetypes
 from pathlib import Path
-from functools import wraps
+from functools import cache, wraps
+from contextlib import contextmanager
+from importlib.util import find_spec
+from concurrent.futures import ThreadPoolExecutor
 import uuid
 
+try:
+    import fcntl  # POSIX only; used to coordinate workers (schema migration, cleanup)
+except ImportError:
+    fcntl = None
+
 import requests
 from flask import (
-    Flask, render_template, request, jsonify, send_from_directory,
-    session, abort
+    Flask, Response, render_template, request, jsonify, send_from_directory,
+    session, abort, stream_with_context
 )
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import desc, func
+from sqlalchemy import desc, event, func, inspect, lambda_stmt, select, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import selectinload
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
-# PyPDF2 for PDF processing (optional)
+# PDF and CSV/Excel libraries are optional and heavy (pandas alone is
+# hundreds of MB per worker), so they're imported on first use only.
+
+@cache
+def has_pdf_support():
+    """Whether PyMuPDF or PyPDF2 is installed (checked without importing)"""
+    return any(find_spec(name) for name in ('pymupdf', 'fitz', 'PyPDF2'))
+
+@cache
+def has_pandas():
+    """Whether pandas is installed (checked without importing)"""
+    return find_spec('pandas') is not None
+
+@cache
+def get_pymupdf():
+    """PyMuPDF for PDF processing (preferred - much faster than PyPDF2), or None"""
+    try:
+        import pymupdf
+    except ImportError:
+        try:
+            import fitz as pymupdf  # PyMuPDF < 1.24.3 only ships the legacy name
+        except ImportError:
+            return None
+    return pymupdf
+
+@cache
+def get_pdf_reader():
+    """PyPDF2's PdfReader (fallback when PyMuPDF is missing), or None"""
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        return None
+    return PdfReader
+
+@cache
+def get_pandas():
+    """pandas for CSV/Excel processing, or None"""
+    try:
+        import pandas
+    except ImportError:
+        return None
+    return pandas
+
+# Flask-Compress for gzip/brotli response compression (optional)
 try:
-    from PyPDF2 import PdfReader
-    PDF_SUPPORT = True
+    from flask_compress import Compress
 except ImportError:
-    PDF_SUPPORT = False
+    Compress = None
 
-# pandas for CSV/Excel processing (optional)
+# orjson for faster JSON parsing/serialization (optional)
 try:
-    import pandas as pd
-    PANDAS_SUPPORT = True
+    import orjson
 except ImportError:
-    PANDAS_SUPPORT = False
+    orjson = None
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (jsonify, request.get_json, sessions).
+
+    json.dumps keyword arguments with an orjson equivalent are mapped onto it
+    (jsonify always passes separators or indent); calls with any other
+    keyword argument (object_hook, cls, ...) go to the stdlib provider.
+    """
+
+    @staticmethod
+    def orjson_option(kwargs):
+        """orjson option flags equivalent to json.dumps kwargs, or None if
+        some argument has no orjson equivalent"""
+        option = orjson.OPT_NON_STR_KEYS
+        for key, value in kwargs.items():
+            if key == 'default':
+                continue
+            if key == 'separators' and tuple(value) == (',', ':'):
+                continue  # orjson's compact output
+            if key == 'indent' and value in (None, 2):
+                option |= orjson.OPT_INDENT_2 if value else 0
+            elif key == 'sort_keys':
+                option |= orjson.OPT_SORT_KEYS if value else 0
+            else:
+                return None
+        return option
+
+    def dumps(self, obj, **kwargs):
+        option = self.orjson_option(kwargs)
+        if option is None:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=kwargs.get('default', self.default), option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# libyaml-backed loader when PyYAML was built with it
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
 
 # Load configuration
+@cache
 def load_config():
-    """Load configuration from YAML file"""
+    """Load configuration from YAML file (parsed once, then cached)"""
     config_path = os.environ.get('CONFIG_FILE', 'config.yaml')
     if os.path.exists(config_path):
         with open(config_path, 'r') as f:
-            return yaml.safe_load(f)
+            return yaml.load(f, Loader=YAML_LOADER)
     else:
         # Default configuration
         return {
@@ -117,7 +214,8 @@ def load_config():
             },
             'advanced': {
                 'memory_per_conversation': 50,
-                'health_check_interval': 300
+                'health_check_interval': 300,
+                'api_pool_size': 32  # keep-alive connections to the GenAI API per worker
             },
             'database': {
                 'type': 'sqlite',  # 'sqlite' or 'postgresql'
@@ -130,6 +228,14 @@ def load_config():
 # Load configuration
 config = load_config()
 
+# Allowed upload extensions, normalised once for O(1) lookups
+ALLOWED_EXTS = frozenset(ext.lower() for ext in config['file_upload']['allowed_extensions'])
+
+MAX_FILE_CONTENT = 50000  # characters of extracted text kept per uploaded file
+MAX_UPLOAD_WORKERS = 8    # threads used to process one request's uploads
+TABLE_SAMPLE_ROWS = 10000 # rows of a CSV/Excel upload parsed for preview + summary
+IN_MEMORY_UPLOAD_LIMIT = 10 * 1024 * 1024  # bytes; larger uploads are spilled to UPLOAD_FOLDER
+
 # Configure app
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', os.urandom(24).hex())
 app.config['MAX_CONTENT_LENGTH'] = config['file_upload']['max_size_mb'] * 1024 * 1024
@@ -147,22 +253,65 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Connection pool sized for threaded workers (one connection per in-flight request)
+if app.config['SQLALCHEMY_DATABASE_URI'].startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_pre_ping': True,  # drop connections the server closed while idle
+        'pool_recycle': 1800
+    }
+elif make_url(app.config['SQLALCHEMY_DATABASE_URI']).database not in (None, '', ':memory:'):
+    # SQLAlchemy already uses a thread-safe QueuePool for file SQLite; keep
+    # more connections pooled so bursts don't reopen the file and rerun the PRAGMAs.
+    # (In-memory SQLite gets a StaticPool, which takes no sizing options.)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 10,
+        'max_overflow': 20
+    }
+
 # Initialize SQLAlchemy
 db = SQLAlchemy(app)
 
+def set_sqlite_pragmas(dbapi_conn, _record):
+    """Per-connection SQLite tuning: WAL so reads don't block on the chat
+    writes, synchronous=NORMAL (safe under WAL) to halve fsyncs per commit"""
+    if not isinstance(dbapi_conn, sqlite3.Connection):
+        return
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-20000")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+with app.app_context():
+    # file-backed SQLite only - WAL means nothing for :memory: databases
+    if db.engine.dialect.name == 'sqlite' and db.engine.url.database not in (None, '', ':memory:'):
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
 # Database Models
 class Conversation(db.Model):
     """Represents a conversation session"""
     __tablename__ = 'conversations'
+    __table_args__ = (
+        db.Index('ix_conv_user_updated', 'user_id', 'updated_at'),  # /conversations listing
+        db.Index('ix_conv_updated', 'updated_at'),  # retention cleanup scan
+    )
     
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = db.Column(db.String(100))  # Optional: for user tracking
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
     title = db.Column(db.String(200))  # Optional: conversation title
+    # Denormalised so listings don't issue a COUNT(*) per conversation
+    message_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     
     # Relationships
-    messages = db.relationship('Message', backref='conversation', lazy='dynamic', 
+    messages = db.relationship('Message', backref='conversation', lazy='select', 
                               cascade='all, delete-orphan', order_by='Message.created_at')
     
     def to_dict(self, include_messages=False):
@@ -172,15 +321,18 @@ class Conversation(db.Model):
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat(),
             'title': self.title,
-            'message_count': self.messages.count()
+            'message_count': self.message_count
         }
         if include_messages:
-            result['messages'] = [msg.to_dict() for msg in self.messages.order_by(Message.created_at)]
+            result['messages'] = [msg.to_dict() for msg in self.messages]  # already ordered by created_at
         return result
 
 class Message(db.Model):
     """Represents a single message in a conversation"""
     __tablename__ = 'messages'
+    __table_args__ = (
+        db.Index('ix_msg_conv_created', 'conversation_id', 'created_at'),  # recent-history query
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     conversation_id = db.Column(db.String(36), db.ForeignKey('conversations.id'), nullable=False)
@@ -200,15 +352,12 @@ class Message(db.Model):
             'tokens_used': self.tokens_used
         }
 
-# Create database tables
-with app.app_context():
-    db.create_all()
-
-# Create necessary directories
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('templates', exist_ok=True)
-os.makedirs('static', exist_ok=True)
-os.makedirs(os.path.dirname(config['logging']['file']), exist_ok=True)
+# Create necessary directories (a single stat when they already exist)
+for directory in (app.config['UPLOAD_FOLDER'], 'templates', 'static',
+                  os.path.dirname(config['logging']['file'])):
+    path = Path(directory)
+    if not path.is_dir():
+        path.mkdir(parents=True, exist_ok=True)
 
 # Configure logging
 log_level = getattr(logging, config['logging']['level'])
@@ -225,10 +374,53 @@ file_handler.setFormatter(logging.Formatter(
 app.logger.addHandler(file_handler)
 logger = app.logger
 
+SCHEMA_LOCK_FILE = os.path.join(os.path.dirname(config['logging']['file']) or '.', 'schema.lock')
+
+@contextmanager
+def schema_lock():
+    """Hold an exclusive lock on SCHEMA_LOCK_FILE, so workers booting together
+    don't race each other through the check-then-alter steps below"""
+    with open(SCHEMA_LOCK_FILE, 'w') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # released when the file closes
+        yield
+
+def ensure_schema():
+    """Create missing tables, then add columns that databases created by
+    earlier versions of this app lack (db.create_all never alters a table)"""
+    with schema_lock():
+        db.create_all()
+        columns = {col['name'] for col in inspect(db.engine).get_columns('conversations')}
+        if 'message_count' not in columns:
+            with db.engine.begin() as conn:
+                conn.execute(text(
+                    "ALTER TABLE conversations ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0"))
+                conn.execute(text(
+                    "UPDATE conversations SET message_count = "
+                    "(SELECT COUNT(*) FROM messages WHERE messages.conversation_id = conversations.id)"))
+            logger.info("schema: added and backfilled conversations.message_count")
+        # create_all only indexes the tables it creates; add new indexes to old
+        # ones (checkfirst is check-then-create too, hence inside the lock)
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+
+# Create database tables
+with app.app_context():
+    ensure_schema()
+
 # Configure CORS
 if config['security']['cors']['enabled']:
     CORS(app, origins=config['security']['cors']['allowed_origins'])
 
+# Configure response compression - JSON/HTML bodies only; streamed responses are
+# left alone since compressing them would buffer output
+if Compress is not None:
+    app.config['COMPRESS_MIMETYPES'] = ['application/json', 'text/html', 'text/css', 'application/javascript']
+    app.config['COMPRESS_LEVEL'] = 4
+    app.config['COMPRESS_STREAMS'] = False
+    Compress(app)
+
 # Configure rate limiting
 limiter = None
 if config['security']['rate_limit']['enabled']:
@@ -248,23 +440,37 @@ retry_strategy = Retry(
     backoff_factor=1,
     status_forcelist=[429, 500, 502, 503, 504],
 )
-adapter = HTTPAdapter(max_retries=retry_strategy)
+# One pool per host (only the GenAI API), sized for concurrent chats per worker
+adapter = HTTPAdapter(
+    max_retries=retry_strategy,
+    pool_connections=4,
+    pool_maxsize=config['advanced'].get('api_pool_size', 32),
+    pool_block=False
+)
 session_requests.mount("http://", adapter)
 session_requests.mount("https://", adapter)
 
 # API configuration
 API_KEY = os.environ.get("GENAI_API_KEY", "")
 
-def get_headers(json_content=True):
-    """Generate request headers"""
-    headers = {}
-    if API_KEY:
-        headers["Authorization"] = f"Bearer {API_KEY}"
-    else:
-        logger.warning("No API key configured! Set GENAI_API_KEY environment variable.")
-    if json_content:
-        headers["Content-Type"] = "application/json"
-    return headers
+# Request headers never change after startup, so set them on the session once
+session_requests.headers["Content-Type"] = "application/json"
+if API_KEY:
+    session_requests.headers["Authorization"] = f"Bearer {API_KEY}"
+else:
+    logger.warning("No API key configured! Set GENAI_API_KEY environment variable.")
+
+def json_loads(data):
+    """Parse JSON text or bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps_pretty(obj):
+    """Indented JSON text, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+    return json.dumps(obj, indent=2)
 
 def require_api_key(f):
     """Decorator to require API key"""
@@ -289,96 +495,276 @@ def get_or_create_conversation(conversation_id=None, user_id=None):
     logger.info(f"Created new conversation: {conversation.id}")
     return conversation
 
+# Hot queries are built with lambda_stmt: SQLAlchemy caches their construction
+# and compiled SQL by the lambdas' code, and closure values become bound parameters
+
+def recent_messages_stmt(conversation_id, limit):
+    """(role, content) of a conversation's newest `limit` messages, oldest first"""
+    def oldest_first(newest):
+        latest = newest.subquery()
+        return select(latest.c.role, latest.c.content).order_by(latest.c.created_at, latest.c.id)
+
+    stmt = lambda_stmt(lambda: select(Message.id, Message.role, Message.content, Message.created_at)
+                       .where(Message.conversation_id == conversation_id)
+                       .order_by(desc(Message.created_at), desc(Message.id))
+                       .limit(limit))
+    stmt += oldest_first
+    return stmt
+
+def user_conversations_stmt(user_id, limit, offset):
+    """A page of the user's conversations, most recently updated first"""
+    return lambda_stmt(lambda: select(Conversation)
+                       .where(Conversation.user_id == user_id)
+                       .order_by(desc(Conversation.updated_at))
+                       .limit(limit)
+                       .offset(offset))
+
+def user_conversation_count_stmt(user_id):
+    """Number of conversations the user has"""
+    return lambda_stmt(lambda: select(func.count())
+                       .select_from(Conversation)
+                       .where(Conversation.user_id == user_id))
+
+# Chat turns are committed here after the response has been returned
+persist_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='persist')
+
+def save_chat_turn(conversation_id, messages, title=None):
+    """Insert a turn's messages and update its conversation (runs on persist_executor)"""
+    with app.app_context():
+        try:
+            # Plain mappings -> one executemany INSERT, no unit-of-work bookkeeping.
+            # Rows are only batched together when they have the same keys, so
+            # the None columns must be rendered rather than dropped per row.
+            db.session.bulk_insert_mappings(Message, messages, render_nulls=True)
+            # message_count = message_count + N in SQL, safe against concurrent turns
+            values = {
+                Conversation.updated_at: datetime.utcnow(),
+                Conversation.message_count: Conversation.message_count + len(messages)
+            }
+            if title:
+                # Only fills an empty title: a turn handled by another worker
+                # may already have set it
+                values[Conversation.title] = func.coalesce(Conversation.title, title)
+            Conversation.query.filter_by(id=conversation_id).update(values, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error saving chat turn for conversation {conversation_id}: {e}")
+
+# Each conversation's most recently queued, not yet committed turn. The next
+# request for that conversation waits on it, so it never reads history,
+# message_count or title from before the previous turn.
+# This only holds within one process: with several gunicorn workers, a
+# follow-up sent to another worker within the commit's few milliseconds can
+# still miss the previous turn from its history.
+_pending_turns = {}
+_pending_turns_lock = threading.Lock()
+
+def submit_chat_turn(conversation_id, messages, title=None):
+    """Queue save_chat_turn on persist_executor and track it until it finishes"""
+    with _pending_turns_lock:
+        future = persist_executor.submit(save_chat_turn, conversation_id, messages, title)
+        _pending_turns[conversation_id] = future
+    future.add_done_callback(lambda f: _forget_chat_turn(conversation_id, f))
+    return future
+
+def _forget_chat_turn(conversation_id, future):
+    with _pending_turns_lock:
+        if _pending_turns.get(conversation_id) is future:
+            del _pending_turns[conversation_id]
+
+def wait_for_chat_turn(conversation_id):
+    """Block until the conversation's queued turn (if any) has been committed"""
+    with _pending_turns_lock:
+        future = _pending_turns.get(conversation_id)
+    if future is not None:
+        future.result()  # save_chat_turn logs and swallows its own errors
+
 def cleanup_old_conversations():
     """Delete conversations older than retention period"""
     retention_days = config.get('database', {}).get('conversation_retention_days', 90)
     cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
     
-    old_conversations = Conversation.query.filter(Conversation.updated_at < cutoff_date).all()
-    for conv in old_conversations:
-        db.session.delete(conv)
+    # Two set-based DELETEs rather than loading every old row through the ORM.
+    # Messages go first and explicitly: databases created by this app have no
+    # ON DELETE CASCADE, and SQLite enforces the foreign key.
+    old_ids = db.select(Conversation.id).where(Conversation.updated_at < cutoff_date)
+    Message.query.filter(Message.conversation_id.in_(old_ids))\
+        .delete(synchronize_session=False)
+    deleted = Conversation.query.filter(Conversation.updated_at < cutoff_date)\
+        .delete(synchronize_session=False)
+    db.session.commit()
     
-    if old_conversations:
-        db.session.commit()
-        logger.info(f"Cleaned up {len(old_conversations)} old conversations")
+    if deleted:
+        logger.info(f"Cleaned up {deleted} old conversations")
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return any(filename.lower().endswith(ext) for ext in config['file_upload']['allowed_extensions'])
+    return Path(filename).suffix.lower() in ALLOWED_EXTS
+
+@contextmanager
+def open_source(source):
+    """Yield a binary file for a path, or rewind an already-open upload stream"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as f:
+            yield f
+    else:
+        source.seek(0)
+        yield source
+
+def decode_text(raw):
+    """UTF-8 text from uploaded bytes, with newlines normalised to \\n as a
+    text-mode open() would do"""
+    return raw.decode('utf-8', errors='ignore').replace('\r\n', '\n').replace('\r', '\n')
+
+def count_table_rows(source, file_ext, sampled_rows):
+    """Count data rows (header excluded) without parsing the table"""
+    if sampled_rows < TABLE_SAMPLE_ROWS:
+        return sampled_rows  # the sample already reached the end of the table
+    if file_ext == '.csv':
+        with open_source(source) as f:
+            return max(sum(1 for _ in f) - 1, 0)
+    if file_ext == '.xlsx':
+        from openpyxl import load_workbook
+        with open_source(source) as f:
+            workbook = load_workbook(f, read_only=True)
+            try:
+                # read_only sheets take max_row from the <dimension> tag, no cell parsing
+                max_row = workbook.worksheets[0].max_row
+            finally:
+                workbook.close()
+        if max_row:
+            return max_row - 1
+    return sampled_rows  # unknown (e.g. .xls) - report what was read
+
+def table_overview(df, total_rows):
+    """Shape, columns, preview and summary statistics of a (sampled) table"""
+    preview = df.head(10).to_string()
+    summary = df.describe().to_string()
+    if len(df) < total_rows:
+        heading = f"Summary statistics (first {len(df)} rows)"
+    else:
+        heading = "Summary statistics"
+    return (
+        f"\nShape: {total_rows} rows, {df.shape[1]} columns\n"
+        f"\nColumns: {', '.join(df.columns)}\n"
+        f"\nFirst few rows:\n{preview}\n"
+        f"\n{heading}:\n{summary}"
+    )
+
+def process_file(source, filename):
+    """Process uploaded file and extract text content
 
-def process_file(filepath, filename):
-    """Process uploaded file and extract text content"""
-    content = f"File: {filename}\n"
+    source is a filesystem path or a seekable binary stream (e.g. an upload
+    still held in memory).
+    """
+    parts = [f"File: {filename}\n"]
     
     try:
         file_ext = Path(filename).suffix.lower()
         
         # Text files
         if file_ext in ['.txt', '.md', '.py', '.cpp', '.java', '.r']:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content += f.read()
+            with open_source(source) as f:
+                parts.append(decode_text(f.read()))
         
         # PDF files
-        elif file_ext == '.pdf' and PDF_SUPPORT:
-            reader = PdfReader(filepath)
-            text = []
-            for page in reader.pages:
-                text.append(page.extract_text())
-            content += '\n'.join(text)
+        elif file_ext == '.pdf' and has_pdf_support():
+            pymupdf = get_pymupdf()
+            with open_source(source) as f:
+                if pymupdf is not None:
+                    with pymupdf.open(stream=f.read(), filetype='pdf') as doc:
+                        text = [page.get_text() for page in doc]
+                else:
+                    reader = get_pdf_reader()(f)
+                    text = [page.extract_text() for page in reader.pages]
+            parts.append('\n'.join(text))
         
         # CSV files
-        elif file_ext == '.csv' and PANDAS_SUPPORT:
-            df = pd.read_csv(filepath)
-            content += f"\nShape: {df.shape[0]} rows, {df.shape[1]} columns\n"
-            content += f"\nColumns: {', '.join(df.columns)}\n"
-            content += f"\nFirst few rows:\n{df.head(10).to_string()}\n"
-            content += f"\nSummary statistics:\n{df.describe().to_string()}"
+        elif file_ext == '.csv' and has_pandas():
+            with open_source(source) as f:
+                df = get_pandas().read_csv(f, nrows=TABLE_SAMPLE_ROWS)
+            parts.append(table_overview(df, count_table_rows(source, file_ext, len(df))))
         
         # Excel files
-        elif file_ext in ['.xlsx', '.xls'] and PANDAS_SUPPORT:
-            df = pd.read_excel(filepath)
-            content += f"\nShape: {df.shape[0]} rows, {df.shape[1]} columns\n"
-            content += f"\nColumns: {', '.join(df.columns)}\n"
-            content += f"\nFirst few rows:\n{df.head(10).to_string()}\n"
-            content += f"\nSummary statistics:\n{df.describe().to_string()}"
+        elif file_ext in ['.xlsx', '.xls'] and has_pandas():
+            with open_source(source) as f:
+                df = get_pandas().read_excel(f, nrows=TABLE_SAMPLE_ROWS)
+            parts.append(table_overview(df, count_table_rows(source, file_ext, len(df))))
         
         # JSON files
         elif file_ext == '.json':
-            with open(filepath, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                content += json.dumps(data, indent=2)
+            # Anything past MAX_FILE_CONTENT is cut by process_upload() anyway, so
+            # never read (or parse) more than that
+            with open_source(source) as f:
+                raw = f.read(MAX_FILE_CONTENT + 1)
+            if len(raw) <= MAX_FILE_CONTENT:
+                parts.append(json_dumps_pretty(json_loads(raw)))
+            else:
+                parts.append(decode_text(raw[:MAX_FILE_CONTENT]))
         
         else:
-            content += f"[Unsupported file type: {file_ext}]"
+            parts.append(f"[Unsupported file type: {file_ext}]")
     
     except Exception as e:
         logger.error(f"Error processing file {filename}: {e}")
-        content += f"\n[Error processing file: {str(e)}]"
+        parts.append(f"\n[Error processing file: {str(e)}]")
     
-    return content
+    return ''.join(parts)
 
-def get_chat_completion(messages):
-    """Get completion from GenAI API"""
-    url = f"{config['genai']['base_url']}/api/chat/completions"
-    
+def upload_size(file):
+    """Size in bytes of an upload's (seekable) stream"""
+    file.stream.seek(0, os.SEEK_END)
+    size = file.stream.tell()
+    file.stream.seek(0)
+    return size
+
+def process_upload(file):
+    """Extract an uploaded file's content - in memory, or via disk if very large"""
+    filename = secure_filename(file.filename)
+    filepath = None
+
+    try:
+        logger.info(f"Processing file: {filename}")
+        if upload_size(file) <= IN_MEMORY_UPLOAD_LIMIT:
+            content = process_file(file.stream, filename)
+        else:
+            unique_filename = f"{int(time.time())}_{secrets.token_hex(4)}_{filename}"
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+            file.save(filepath)
+            content = process_file(filepath, filename)
+        logger.info(f"Extracted {len(content)} characters from {filename}")
+
+        # Truncate if too long (API may have limits)
+        if len(content) > MAX_FILE_CONTENT:
+            logger.warning(f"File content too long ({len(content)} chars), truncating to {MAX_FILE_CONTENT}")
+            content = content[:MAX_FILE_CONTENT] + f"\n\n[Content truncated - file was too long. Showing first {MAX_FILE_CONTENT} characters]"
+
+        return content
+    except Exception as e:
+        logger.error(f"Error handling file {filename}: {e}")
+        return f"File: {filename}\n[Error processing file: {str(e)}]"
+    finally:
+        if filepath and os.path.exists(filepath):
+            os.remove(filepath)
+
+def completion_payload(messages, stream=False):
+    """Request body for the GenAI chat completions endpoint"""
     payload = {
         "model": config['genai']['model'],
         "messages": messages,
         "temperature": config['genai']['temperature'],
         "max_tokens": config['genai']['max_tokens']
     }
-    
-    try:
-        response = session_requests.post(
-            url,
-            headers=get_headers(),
-            json=payload,
-            timeout=config['genai']['timeout']
-        )
-        response.raise_for_status()
-        return response.json()
-    
-    except requests.exceptions.HTTPError as e:
+    if stream:
+        payload["stream"] = True
+        # OpenAI-compatible APIs only report usage in a stream when asked to
+        payload["stream_options"] = {"include_usage": True}
+    return payload
+
+def api_error(e, caller):
+    """{"error": ...} result for an exception raised while calling the GenAI API"""
+    if isinstance(e, requests.exceptions.HTTPError):
         logger.error(f"HTTP error from GenAI API: {e}")
         error_detail = "Service unavailable"
         try:
@@ -386,32 +772,180 @@ def get_chat_completion(messages):
         except:
             pass
         return {"error": f"API error: {error_detail}"}
-    
-    except requests.exceptions.Timeout:
+    if isinstance(e, requests.exceptions.Timeout):
         logger.error("Timeout connecting to GenAI API")
         return {"error": "Request timeout. Please try again."}
-    
-    except requests.exceptions.RequestException as e:
+    if isinstance(e, requests.exceptions.RequestException):
         logger.error(f"Error connecting to GenAI API: {e}")
         return {"error": f"Connection error: {str(e)}"}
+    logger.error(f"Unexpected error in {caller}: {e}")
+    return {"error": f"Unexpected error: {str(e)}"}
+
+def get_chat_completion(messages):
+    """Get completion from GenAI API"""
+    url = f"{config['genai']['base_url']}/api/chat/completions"
+    
+    try:
+        response = session_requests.post(
+            url,
+            json=completion_payload(messages),
+            timeout=config['genai']['timeout']
+        )
+        response.raise_for_status()
+        return json_loads(response.content)
     
     except Exception as e:
-        logger.error(f"Unexpected error in get_chat_completion: {e}")
-        return {"error": f"Unexpected error: {str(e)}"}
+        return api_error(e, 'get_chat_completion')
 
-def health_check():
+def stream_chat_completion(messages):
+    """Stream a completion from GenAI API, yielding each parsed chunk.
+
+    A failure is yielded as a final {"error": ...} chunk, as get_chat_completion
+    would return it.
+    """
+    url = f"{config['genai']['base_url']}/api/chat/completions"
+    
+    response = None
+    try:
+        response = session_requests.post(
+            url,
+            json=completion_payload(messages, stream=True),
+            timeout=config['genai']['timeout'],
+            stream=True
+        )
+        response.raise_for_status()
+        # chunk_size=None hands over data as it arrives instead of
+        # waiting for a full read buffer
+        for line in response.iter_lines(chunk_size=None):
+            if not line.startswith(b'data:'):
+                continue
+            data = line[5:].strip()
+            if data == b'[DONE]':
+                break
+            yield json_loads(data)
+    
+    except Exception as e:
+        yield api_error(e, 'stream_chat_completion')
+    
+    finally:
+        # Closed only now so api_error can still read an error body
+        if response is not None:
+            response.close()
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no"  # stop nginx from buffering the stream
+}
+
+def format_sse(event, data):
+    """One server-sent event with a JSON data line"""
+    return f"event: {event}\ndata: {app.json.dumps(data)}\n\n"
+
+def chat_error_message(error, user_message_content):
+    """The error shown to the user when the completion fails"""
+    # Check if error might be due to file content
+    if len(user_message_content) > 10000:
+        error += " (Note: Message is very long - may be due to file attachment. Try with a smaller file or just text.)"
+    return error
+
+def stream_chat_turn(conversation_id, message_count, messages, user_message, title=None):
+    """SSE events for one chat turn - token* then done | error - persisting it at the end"""
+    parts = []
+    model_used = config['genai']['model']
+    usage = {}
+    error = None
+    try:
+        for chunk in stream_chat_completion(messages):
+            if "error" in chunk:
+                error = chunk['error']
+                break
+            model_used = chunk.get('model') or model_used
+            usage = chunk.get('usage') or usage
+            choices = chunk.get('choices')
+            delta = choices[0].get('delta', {}).get('content') if choices else None
+            if delta:
+                parts.append(delta)
+                yield format_sse('token', {"content": delta})
+    except GeneratorExit:
+        # Client went away mid-answer; its question is still part of the history
+        submit_chat_turn(conversation_id, [user_message])
+        raise
+    
+    # Outside the try: a client closing after the error event must not
+    # persist the user's message a second time
+    if error is not None:
+        if isinstance(error, dict):
+            error = f"API error: {error.get('message', error)}"
+        # Keep the user's side of the history even though the API call failed
+        submit_chat_turn(conversation_id, [user_message])
+        yield format_sse('error', {"error": chat_error_message(error, user_message['content'])})
+        return
+    
+    assistant_message = {
+        'conversation_id': conversation_id,
+        'role': 'assistant',
+        'content': ''.join(parts),
+        'model': model_used,
+        'tokens_used': usage.get('total_tokens'),
+        'created_at': datetime.utcnow()
+    }
+    submit_chat_turn(conversation_id, [user_message, assistant_message], title)
+    
+    yield format_sse('done', {
+        "conversation_id": conversation_id,
+        "model": model_used,
+        "usage": usage,
+        "message_count": message_count + 2
+    })
+
+DB_HEALTH_TTL = 10  # seconds a database health result is reused
+
+# Last result of each health probe, by name: (monotonic time, result)
+_probe_results = {}
+
+def cached_probe(name, ttl, probe):
+    """Return probe()'s last result if it is younger than ttl seconds, else re-run it"""
+    now = time.monotonic()
+    cached = _probe_results.get(name)
+    if cached is not None and now - cached[0] < ttl:
+        return cached[1]
+    result = probe()
+    _probe_results[name] = (now, result)
+    return result
+
+def probe_api():
     """Check if GenAI API is accessible"""
     try:
         url = f"{config['genai']['base_url']}/api/models"
         response = session_requests.get(
             url,
-            headers=get_headers(),
             timeout=5
         )
         return response.status_code == 200
     except:
         return False
 
+def probe_database():
+    """Check the database responds, and count its rows for /health"""
+    try:
+        db.session.execute(text('SELECT 1'))
+        return {
+            'healthy': True,
+            'total_conversations': Conversation.query.count(),
+            'total_messages': Message.query.count()
+        }
+    except:
+        db.session.rollback()
+        return {'healthy': False, 'total_conversations': None, 'total_messages': None}
+
+def health_check():
+    """Check if GenAI API is accessible (cached for advanced.health_check_interval)"""
+    return cached_probe('api', config['advanced']['health_check_interval'], probe_api)
+
+def database_health():
+    """Database probe result (cached for DB_HEALTH_TTL seconds)"""
+    return cached_probe('database', DB_HEALTH_TTL, probe_database)
+
 def build_footer_text():
     """Build dynamic footer text from configuration"""
     if config['ui'].get('footer_text'):
@@ -427,21 +961,23 @@ def build_footer_text():
     
     return ' • '.join(parts)
 
+# Template values for the chat page - config is static after load, so build once
+TEMPLATE_CONFIG = {
+    'COURSE_NAME': config['course']['name'],
+    'ASSISTANT_NAME': config['assistant']['name'],
+    'ASSISTANT_TITLE': config['assistant']['title'],
+    'WELCOME_MESSAGE': config['assistant']['welcome_message'],
+    'INPUT_PLACEHOLDER': config['assistant']['input_placeholder'],
+    'LOGO_FILE': config['ui']['logo_file'],
+    'AI_PROVIDER': config['ui']['ai_provider'],
+    'FOOTER_TEXT': build_footer_text()
+}
+
 @app.route('/')
 def index():
     """Render the main chat interface"""
     health = health_check()
-    template_config = {
-        'COURSE_NAME': config['course']['name'],
-        'ASSISTANT_NAME': config['assistant']['name'],
-        'ASSISTANT_TITLE': config['assistant']['title'],
-        'WELCOME_MESSAGE': config['assistant']['welcome_message'],
-        'INPUT_PLACEHOLDER': config['assistant']['input_placeholder'],
-        'LOGO_FILE': config['ui']['logo_file'],
-        'AI_PROVIDER': config['ui']['ai_provider'],
-        'FOOTER_TEXT': build_footer_text()
-    }
-    return render_template('index.html', health_status=health, config=template_config)
+    return render_template('index.html', health_status=health, config=TEMPLATE_CONFIG)
 
 @app.route('/chat', methods=['POST'])
 @require_api_key
@@ -462,104 +998,97 @@ def chat():
             user_message_content = request.form.get('message')
             logger.info(f"Multipart request - conversation_id: {conversation_id}, message length: {len(user_message_content) if user_message_content else 0}")
 
-            # Process uploaded files
+            # Process uploaded files (independent, so in parallel)
             file_contents = []
             if 'files' in request.files:
-                files = request.files.getlist('files')
+                files = [f for f in request.files.getlist('files') if f and allowed_file(f.filename)]
                 logger.info(f"Processing {len(files)} uploaded file(s)")
-                for file in files:
-                    if file and allowed_file(file.filename):
-                        filename = secure_filename(file.filename)
-                        unique_filename = f"{int(time.time())}_{hashlib.md5(filename.encode()).hexdigest()[:8]}_{filename}"
-                        filepath = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-
-                        try:
-                            file.save(filepath)
-                            logger.info(f"Processing file: {filename}")
-                            content = process_file(filepath, filename)
-                            logger.info(f"Extracted {len(content)} characters from {filename}")
-
-                            # Truncate if too long (API may have limits)
-                            MAX_FILE_CONTENT = 50000  # characters
-                            if len(content) > MAX_FILE_CONTENT:
-                                logger.warning(f"File content too long ({len(content)} chars), truncating to {MAX_FILE_CONTENT}")
-                                content = content[:MAX_FILE_CONTENT] + f"\n\n[Content truncated - file was too long. Showing first {MAX_FILE_CONTENT} characters]"
-
-                            file_contents.append(content)
-                            os.remove(filepath)
-                        except Exception as e:
-                            logger.error(f"Error handling file {filename}: {e}")
-                            file_contents.append(f"File: {filename}\n[Error processing file: {str(e)}]")
+                if files:
+                    with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(files))) as pool:
+                        file_contents = list(pool.map(process_upload, files))
 
             # Add file contents to message
             if file_contents:
-                file_context = "\n\n--- Attached Files ---\n" + "\n\n".join(file_contents)
-                user_message_content += file_context
+                user_message_content = ''.join([
+                    user_message_content, "\n\n--- Attached Files ---\n", "\n\n".join(file_contents)
+                ])
                 logger.info(f"Total message length with files: {len(user_message_content)} characters")
         else:
-            # Regular JSON request
-            logger.info(f"Attempting to parse JSON request")
-            logger.info(f"Request data: {request.data}")
-            logger.info(f"Request headers: {dict(request.headers)}")
+            # Regular JSON request - parsed once; None if the body isn't valid JSON
+            # (force=True keeps accepting clients that omit the JSON content type)
+            logger.info(f"JSON request - {request.content_length or 0} bytes")
+            data = request.get_json(force=True, silent=True)
 
-            # Try multiple ways to get the data
-            data = None
-            try:
-                data = request.get_json(force=True, silent=False)
-            except Exception as e:
-                logger.error(f"Error parsing JSON with get_json: {e}")
-                # Fallback to request.json
-                try:
-                    data = request.json
-                except Exception as e2:
-                    logger.error(f"Error with request.json: {e2}")
-
-            if not data:
+            if not isinstance(data, dict) or not data:
                 logger.error("No JSON data in request")
                 return jsonify({"error": "No data provided. Please ensure you're sending valid JSON."}), 400
 
-            logger.info(f"Parsed JSON data: {data}")
             conversation_id = data.get('conversation_id')
             user_message_content = data.get('message')
-            logger.info(f"JSON request - conversation_id: {conversation_id}, message: {user_message_content}")
+            logger.info(f"JSON request - conversation_id: {conversation_id}, message length: {len(user_message_content) if isinstance(user_message_content, str) else 0}")
 
-        if not user_message_content or (isinstance(user_message_content, str) and len(user_message_content.strip()) == 0):
+        if not user_message_content or (isinstance(user_message_content, str) and user_message_content.isspace()):
             logger.error(f"No message content - user_message_content: '{user_message_content}'")
             return jsonify({"error": "No message provided"}), 400
         
+        # Let this conversation's previous turn land before reading it back
+        if conversation_id:
+            wait_for_chat_turn(conversation_id)
+        
         # Get or create conversation
         user_id = session.get('user_id') or request.remote_addr
         conversation = get_or_create_conversation(conversation_id, user_id)
         
-        # Save user message to database
-        user_message = Message(
-            conversation_id=conversation.id,
-            role='user',
-            content=user_message_content
-        )
-        db.session.add(user_message)
-        db.session.commit()
-        
-        # Get recent messages for context (limit to max_messages)
+        # Get recent messages for context (limit to max_messages, counting this one)
         max_messages = config['advanced']['memory_per_conversation']
-        recent_messages = Message.query.filter_by(conversation_id=conversation.id)\
-            .order_by(desc(Message.created_at))\
-            .limit(max_messages)\
-            .all()
-        recent_messages.reverse()  # Oldest first
+        recent_messages = db.session.execute(
+            recent_messages_stmt(conversation.id, max_messages - 1)
+        ).all()
         
         # Build messages array for API
-        messages = [{"role": msg.role, "content": msg.content} for msg in recent_messages]
+        messages = [{"role": role, "content": content} for role, content in recent_messages]
+        messages.append({"role": "user", "content": user_message_content})
+        
+        # Nothing is written before the API call; the whole turn is persisted
+        # afterwards, off the request thread (see submit_chat_turn)
+        user_message = {
+            'conversation_id': conversation.id,
+            'role': 'user',
+            'content': user_message_content,
+            'model': None,  # same keys as the assistant row, see save_chat_turn
+            'tokens_used': None,
+            'created_at': datetime.utcnow()
+        }
+        
+        # Auto-generate title from first message if not set
+        title = None
+        if not conversation.title and conversation.message_count == 0:
+            title = user_message_content[:100]
+        
+        # Clients that ask for an event stream get tokens as the API produces them
+        if request.accept_mimetypes.best == 'text/event-stream':
+            logger.info(f"Streaming {len(messages)} messages to API")
+            conversation_id, message_count = conversation.id, conversation.message_count
+            # stream_with_context keeps the app context (and so this session) alive
+            # until the stream ends; release the connection and its read
+            # transaction now - stream_chat_turn never touches the session
+            db.session.close()
+            return Response(
+                stream_with_context(stream_chat_turn(
+                    conversation_id, message_count, messages, user_message, title
+                )),
+                mimetype='text/event-stream',
+                headers=SSE_HEADERS
+            )
         
         # Get completion from API
         logger.info(f"Sending {len(messages)} messages to API, total chars in last message: {len(messages[-1]['content']) if messages else 0}")
         result = get_chat_completion(messages)
 
         if "error" in result:
-            error_msg = result['error']
-            # Check if error might be due to file content
-            if len(user_message_content) > 10000:
-                error_msg += " (Note: Message is very long - may be due to file attachment. Try with a smaller file or just text.)"
+            error_msg = chat_error_message(result['error'], user_message_content)
+            # Keep the user's side of the history even though the API call failed
+            submit_chat_turn(conversation.id, [user_message])
             return jsonify({"error": error_msg}), 500
         
         # Extract assistant's response
@@ -567,31 +1096,24 @@ def chat():
         model_used = result.get('model', config['genai']['model'])
         tokens_used = result.get('usage', {}).get('total_tokens')
         
-        # Save assistant message to database
-        assistant_message = Message(
-            conversation_id=conversation.id,
-            role='assistant',
-            content=assistant_content,
-            model=model_used,
-            tokens_used=tokens_used
-        )
-        db.session.add(assistant_message)
-        
-        # Update conversation timestamp
-        conversation.updated_at = datetime.utcnow()
-        
-        # Auto-generate title from first message if not set
-        if not conversation.title and conversation.messages.count() == 2:
-            conversation.title = user_message_content[:100]
+        assistant_message = {
+            'conversation_id': conversation.id,
+            'role': 'assistant',
+            'content': assistant_content,
+            'model': model_used,
+            'tokens_used': tokens_used,
+            'created_at': datetime.utcnow()
+        }
         
-        db.session.commit()
+        # Respond now; the DB commit doesn't add to the user-visible latency
+        submit_chat_turn(conversation.id, [user_message, assistant_message], title)
         
         return jsonify({
             "content": assistant_content,
             "conversation_id": conversation.id,
             "model": model_used,
             "usage": result.get('usage', {}),
-            "message_count": conversation.messages.count()
+            "message_count": conversation.message_count + 2
         })
         
     except Exception as e:
@@ -606,26 +1128,26 @@ def list_conversations():
     limit = request.args.get('limit', 20, type=int)
     offset = request.args.get('offset', 0, type=int)
     
-    conversations = Conversation.query.filter_by(user_id=user_id)\
-        .order_by(desc(Conversation.updated_at))\
-        .limit(limit)\
-        .offset(offset)\
-        .all()
+    conversations = db.session.scalars(user_conversations_stmt(user_id, limit, offset)).all()
     
     return jsonify({
         "conversations": [conv.to_dict() for conv in conversations],
-        "total": Conversation.query.filter_by(user_id=user_id).count()
+        "total": db.session.scalar(user_conversation_count_stmt(user_id))
     })
 
 @app.route('/conversations/<conversation_id>', methods=['GET'])
 def get_conversation(conversation_id):
     """Get a specific conversation with all messages"""
-    conversation = Conversation.query.get_or_404(conversation_id)
+    conversation = Conversation.query.options(selectinload(Conversation.messages))\
+        .filter_by(id=conversation_id)\
+        .one_or_404()
     return jsonify(conversation.to_dict(include_messages=True))
 
 @app.route('/conversations/<conversation_id>', methods=['DELETE'])
 def delete_conversation(conversation_id):
     """Delete a conversation"""
+    # A still-queued turn would otherwise insert messages for a deleted conversation
+    wait_for_chat_turn(conversation_id)
     conversation = Conversation.query.get_or_404(conversation_id)
     db.session.delete(conversation)
     db.session.commit()
@@ -634,14 +1156,16 @@ def delete_conversation(conversation_id):
 @app.route('/conversations/<conversation_id>/export', methods=['GET'])
 def export_conversation(conversation_id):
     """Export a conversation as JSON"""
-    conversation = Conversation.query.get_or_404(conversation_id)
+    conversation = Conversation.query.options(selectinload(Conversation.messages))\
+        .filter_by(id=conversation_id)\
+        .one_or_404()
     
     return jsonify({
         "course": config['course']['name'],
         "conversation_id": conversation.id,
         "created_at": conversation.created_at.isoformat(),
         "title": conversation.title,
-        "messages": [msg.to_dict() for msg in conversation.messages.order_by(Message.created_at)]
+        "messages": [msg.to_dict() for msg in conversation.messages]
     })
 
 @app.route('/clear-session', methods=['POST'])
@@ -659,26 +1183,20 @@ def serve_static(filename):
 def app_health():
     """Check application and API health"""
     api_health = health_check()
-    
-    # Database health check
-    try:
-        db.session.execute('SELECT 1')
-        db_health = True
-    except:
-        db_health = False
+    db_health = database_health()
     
     return jsonify({
         "app": "healthy",
         "api": "healthy" if api_health else "unhealthy",
-        "database": "healthy" if db_health else "unhealthy",
+        "database": "healthy" if db_health['healthy'] else "unhealthy",
         "model": config['genai']['model'],
         "course": config['course']['name'],
         "features": config['features'],
         "file_upload_enabled": config['file_upload']['enabled'],
-        "pdf_support": PDF_SUPPORT,
-        "excel_support": PANDAS_SUPPORT,
-        "total_conversations": Conversation.query.count(),
-        "total_messages": Message.query.count()
+        "pdf_support": has_pdf_support(),
+        "excel_support": has_pandas(),
+        "total_conversations": db_health['total_conversations'],
+        "total_messages": db_health['total_messages']
     })
 
 @app.route('/config-info')
@@ -747,24 +1265,58 @@ def handle_not_found(e):
         "error": "Resource not found"
     }), 404
 
-@app.before_request
-def before_request():
-    """Set session permanent and cleanup old conversations"""
-    session.permanent = True
-    
-    # Cleanup old conversations periodically (1% chance per request)
-    import random
-    if random.random() < 0.01:
+CLEANUP_FIRST_DELAY_SECONDS = 60
+CLEANUP_INTERVAL_SECONDS = 3600
+CLEANUP_LOCK_FILE = os.path.join(os.path.dirname(config['logging']['file']) or '.', 'cleanup.lock')
+
+def cleanup_loop():
+    """Run cleanup_old_conversations() shortly after startup, then hourly,
+    off the request path.
+
+    Every worker runs this thread, but only the one holding an exclusive lock
+    on CLEANUP_LOCK_FILE does the work; if it exits, another takes over.
+    """
+    lock_file = open(CLEANUP_LOCK_FILE, 'w')
+    delay = CLEANUP_FIRST_DELAY_SECONDS
+    while True:
+        time.sleep(delay)
+        delay = CLEANUP_INTERVAL_SECONDS
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue  # another worker does the cleanup
         try:
-            cleanup_old_conversations()
+            with app.app_context():
+                cleanup_old_conversations()
         except Exception as e:
             logger.error(f"Error during cleanup: {e}")
 
+_cleanup_thread = None
+_cleanup_thread_lock = threading.Lock()
+
+def start_cleanup_scheduler():
+    """Start cleanup_loop in this process, once. Called when the app serves
+    requests, so importing the module (flask CLI, scripts, tests) doesn't"""
+    global _cleanup_thread
+    if _cleanup_thread is not None:
+        return
+    with _cleanup_thread_lock:
+        if _cleanup_thread is None:
+            _cleanup_thread = threading.Thread(target=cleanup_loop, name='conversation-cleanup', daemon=True)
+            _cleanup_thread.start()
+
+@app.before_request
+def before_request():
+    """Set session permanent and make sure this worker runs the cleanup scheduler"""
+    start_cleanup_scheduler()
+    session.permanent = True
+
 # CLI commands for database management
 @app.cli.command()
 def init_db():
     """Initialize the database"""
-    db.create_all()
+    ensure_schema()
     print("Database initialized successfully!")
 
 @app.cli.command()
@@ -785,10 +1337,8 @@ def db_stats():
 application = app
 
 if __name__ == '__main__':
-    # Check API key
-    if not API_KEY:
-        logger.warning("⚠️  No API key found. Set GENAI_API_KEY environment variable.")
-    else:
+    # Check API key (a missing key was already warned about at import)
+    if API_KEY:
         logger.info("✅ API key is configured")
     
     # Log configuration
@@ -798,8 +1348,11 @@ if __name__ == '__main__':
     logger.info(f"📎 File upload: {'Enabled' if config['file_upload']['enabled'] else 'Disabled'}")
     
     print("⚠️  Running with Flask development server. Use Gunicorn for production!")
-    print("💡 To run with Gunicorn:")
-    print("   gunicorn -w 4 -b 0.0.0.0:5000 --timeout 120 app:application")
+    print("💡 To run with Gunicorn (threaded workers - /chat mostly waits on the GenAI API):")
+    print("   gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:5000 --timeout 120 app:application")
+    print("   (chat turns are committed just after responding; only requests in the same")
+    print("    worker wait for that, so use -w 1 with more --threads if back-to-back")
+    print("    messages must always see the previous reply)")
     
     debug_mode = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,384 @@
+"""Regression tests for the single-file Flask app (genaiStudio_app_database.py).
+
+Chat turns are persisted after the response, off the request thread, so most
+tests pin down what each kind of turn leaves in the database; the GenAI API
+is mocked at session_requests.post. The rest cover upload parsing, retention
+cleanup and schema upgrades."""
+
+from __future__ import annotations
+
+import importlib
+import io
+import sqlite3
+import subprocess
+import sys
+import time
+from pathlib import Path
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+import requests
+import yaml
+
+ROOT = Path(__file__).resolve().parents[1]
+
+
+def _config(tmp: Path) -> dict:
+    return {
+        "course": {"name": "STAT 350", "department": "Department of Statistics"},
+        "assistant": {"name": "Course Assistant", "title": "Course Assistant",
+                      "welcome_message": "Hi", "input_placeholder": "Ask"},
+        "genai": {"base_url": "http://genai.test", "model": "test-model",
+                  "temperature": 0.7, "timeout": 5, "max_tokens": 100},
+        "ui": {"logo_file": "logo.png", "ai_provider": "Lattice AI", "footer_text": None},
+        "file_upload": {"enabled": True, "max_size_mb": 10, "allowed_extensions": [".txt"]},
+        "features": {},
+        "security": {"rate_limit": {"enabled": False},
+                     "cors": {"enabled": False},
+                     "session": {"timeout_minutes": 120}},
+        "logging": {"level": "WARNING", "file": str(tmp / "logs" / "assistant.log"),
+                    "max_size_mb": 1, "backup_count": 1},
+        "advanced": {"memory_per_conversation": 50, "health_check_interval": 300},
+        "database": {"type": "sqlite", "sqlite_path": str(tmp / "conversations.db"),
+                     "conversation_retention_days": 90},
+    }
+
+
+@pytest.fixture(scope="module")
+def studio(tmp_path_factory):
+    """The app module, imported against a throwaway config and database."""
+    tmp = tmp_path_factory.mktemp("studio")
+    config_file = tmp / "config.yaml"
+    config_file.write_text(yaml.safe_dump(_config(tmp)))
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(tmp)  # uploads/, templates/, static/ are created relative to cwd
+        mp.setenv("CONFIG_FILE", str(config_file))
+        mp.setenv("GENAI_API_KEY", "test-key")
+        mp.syspath_prepend(str(ROOT))
+        sys.modules.pop("genaiStudio_app_database", None)
+        module = importlib.import_module("genaiStudio_app_database")
+        yield module
+        sys.modules.pop("genaiStudio_app_database", None)
+
+
+@pytest.fixture()
+def client(studio):
+    return studio.app.test_client()
+
+
+@pytest.fixture()
+def conversation_id(studio):
+    with studio.app.app_context():
+        conversation = studio.Conversation(user_id="127.0.0.1")
+        studio.db.session.add(conversation)
+        studio.db.session.commit()
+        return conversation.id
+
+
+class FakeStream:
+    """A streamed completion: one SSE data line per token, a usage chunk if
+    the request asked for one (stream_options.include_usage), then [DONE]."""
+
+    def __init__(self, tokens, model="test-model", usage=None):
+        self.tokens = tokens
+        self.model = model
+        self.usage = usage
+
+    def __call__(self, url, json, **kwargs):
+        lines = [
+            b'data: {"model": "%s", "choices": [{"delta": {"content": "%s"}}]}'
+            % (self.model.encode(), token.encode())
+            for token in self.tokens
+        ]
+        if self.usage and json.get("stream_options", {}).get("include_usage"):
+            lines.append(b'data: {"choices": [], "usage": {"total_tokens": %d}}'
+                         % self.usage)
+        lines.append(b"data: [DONE]")
+        self.lines = lines
+        return self
+
+    def raise_for_status(self):
+        pass
+
+    def iter_lines(self, chunk_size=None):
+        yield from self.lines
+
+    def close(self):
+        pass
+
+
+def _completion(content: str) -> mock.Mock:
+    response = mock.Mock()
+    response.content = (b'{"model": "test-model", "usage": {"total_tokens": 7}, '
+                        b'"choices": [{"message": {"content": "%s"}}]}'
+                        % content.encode())
+    return response
+
+
+def _settled(studio, cid: str) -> tuple[object, list[tuple[str, str]]]:
+    """The conversation and its (role, content) rows once its turn has landed."""
+    studio.wait_for_chat_turn(cid)
+    with studio.app.app_context():
+        conversation = studio.db.session.get(studio.Conversation, cid)
+        rows = [(m.role, m.content) for m in conversation.messages]
+        studio.db.session.expunge(conversation)
+        return conversation, rows
+
+
+def _stream(client, cid: str, message: str):
+    return client.post("/chat", json={"conversation_id": cid, "message": message},
+                       headers={"Accept": "text/event-stream"}, buffered=False)
+
+
+def test_followup_turn_sees_previous_turn(studio, client, conversation_id):
+    save = studio.save_chat_turn
+
+    def slow_save(*args, **kwargs):
+        time.sleep(0.3)  # the follow-up arrives while this turn is still queued
+        save(*args, **kwargs)
+
+    with mock.patch.object(studio, "save_chat_turn", slow_save), \
+            mock.patch.object(studio.session_requests, "post",
+                              side_effect=[_completion("first answer"),
+                                           _completion("second answer")]) as post:
+        r1 = client.post("/chat", json={"conversation_id": conversation_id,
+                                        "message": "first question"})
+        r2 = client.post("/chat", json={"conversation_id": conversation_id,
+                                        "message": "second question"})
+
+    assert r1.status_code == r2.status_code == 200
+    sent = post.call_args_list[1].kwargs["json"]["messages"]
+    assert sent == [
+        {"role": "user", "content": "first question"},
+        {"role": "assistant", "content": "first answer"},
+        {"role": "user", "content": "second question"},
+    ]
+    assert r2.get_json()["message_count"] == 4
+    conversation, rows = _settled(studio, conversation_id)
+    assert conversation.message_count == 4
+    assert [role for role, _ in rows] == ["user", "assistant", "user", "assistant"]
+
+
+def test_failed_stream_keeps_one_user_message(studio, client, conversation_id):
+    with mock.patch.object(studio.session_requests, "post",
+                           side_effect=requests.exceptions.ConnectionError("down")):
+        r = _stream(client, conversation_id, "question")
+        body = b"".join(r.response).decode()
+        r.close()
+
+    assert "event: error" in body
+    conversation, rows = _settled(studio, conversation_id)
+    assert rows == [("user", "question")]
+    assert conversation.message_count == 1
+
+
+def test_abandoned_stream_keeps_one_user_message(studio, client, conversation_id):
+    with mock.patch.object(studio.session_requests, "post",
+                           side_effect=FakeStream(["Hel", "lo", "!"])):
+        r = _stream(client, conversation_id, "question")
+        first = next(iter(r.response))
+        r.close()  # the client disconnects after the first token
+
+    assert b"event: token" in first
+    conversation, rows = _settled(studio, conversation_id)
+    assert rows == [("user", "question")]
+    assert conversation.message_count == 1
+
+
+def test_stream_persists_turn_and_title(studio, client, conversation_id):
+    with mock.patch.object(studio.session_requests, "post",
+                           side_effect=FakeStream(["Hel", "lo"], usage=12)):
+        r = _stream(client, conversation_id, "what is a p-value?")
+        body = b"".join(r.response).decode()
+        r.close()
+
+    assert body.count("event: token") == 2
+    assert '"message_count":2' in body.replace(" ", "")
+    assert '"usage":{"total_tokens":12}' in body.replace(" ", "")
+    conversation, rows = _settled(studio, conversation_id)
+    assert rows == [("user", "what is a p-value?"), ("assistant", "Hello")]
+    assert conversation.message_count == 2
+    assert conversation.title == "what is a p-value?"
+    with studio.app.app_context():
+        reply = studio.Message.query.filter_by(conversation_id=conversation_id,
+                                               role="assistant").one()
+        assert (reply.model, reply.tokens_used) == ("test-model", 12)
+
+
+def test_jsonify_goes_through_orjson(studio):
+    if studio.orjson is None:
+        pytest.skip("orjson not installed")
+    with mock.patch.object(studio.orjson, "dumps", wraps=studio.orjson.dumps) as dumps, \
+            studio.app.test_request_context():
+        body = studio.jsonify({"b": 1, "a": 2}).get_data(as_text=True)
+    assert {"b": 1, "a": 2} in [c.args[0] for c in dumps.call_args_list]
+    assert body == '{"b":1,"a":2}\n'  # insertion order, compact - orjson's output
+
+
+def test_session_serializer_round_trips_tagged_values(studio):
+    serializer = studio.app.session_interface.get_signing_serializer(studio.app)
+    value = {"t": (1, 2), "b": b"x", "_permanent": True}
+    with studio.app.app_context():
+        assert serializer.loads(serializer.dumps(value)) == value
+    with studio.app.app_context():
+        # a stdlib-only keyword argument still reaches json.loads
+        assert studio.app.json.loads('{"a": 1}', object_hook=lambda d: ("hooked", d)) \
+            == ("hooked", {"a": 1})
+
+
+def _run_app(tmp_path: Path, config: dict, script: str) -> str:
+    """stdout of `script` run in a fresh interpreter after importing the app
+    (as `m`) against `config` - for behaviour that happens at import."""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.safe_dump(config))
+    result = subprocess.run(
+        [sys.executable, "-c", "import genaiStudio_app_database as m\n" + script],
+        cwd=tmp_path, capture_output=True, text=True,
+        env={"PATH": "", "PYTHONPATH": str(ROOT), "CONFIG_FILE": str(config_file)},
+    )
+    assert result.returncode == 0, result.stderr
+    return result.stdout.strip()
+
+
+def test_in_memory_sqlite_imports(tmp_path):
+    """:memory: SQLite gets a StaticPool, which rejects pool sizing options."""
+    config = _config(tmp_path)
+    config["database"]["sqlite_path"] = ":memory:"
+    out = _run_app(tmp_path, config, "with m.app.app_context():\n"
+                                     "    print(type(m.db.engine.pool).__name__)")
+    assert out == "StaticPool"
+
+
+def test_schema_upgrade_backfills_message_count(tmp_path):
+    db_path = tmp_path / "conversations.db"
+    with sqlite3.connect(db_path) as conn:  # a database from before message_count
+        conn.executescript("""
+            CREATE TABLE conversations (id VARCHAR(36) PRIMARY KEY, user_id VARCHAR(100),
+                created_at DATETIME NOT NULL, updated_at DATETIME NOT NULL, title VARCHAR(200));
+            CREATE TABLE messages (id INTEGER PRIMARY KEY, conversation_id VARCHAR(36) NOT NULL
+                REFERENCES conversations(id), role VARCHAR(20) NOT NULL, content TEXT NOT NULL,
+                created_at DATETIME NOT NULL, model VARCHAR(100), tokens_used INTEGER);
+            INSERT INTO conversations VALUES ('a', 'u', '2024-01-01', '2024-01-01', NULL);
+            INSERT INTO conversations VALUES ('b', 'u', '2024-01-01', '2024-01-01', NULL);
+            INSERT INTO messages (conversation_id, role, content, created_at)
+                VALUES ('a', 'user', 'q', '2024-01-01'), ('a', 'assistant', 'r', '2024-01-01');
+        """)
+    out = _run_app(tmp_path, _config(tmp_path),
+                   "with m.app.app_context():\n"
+                   "    print(sorted((c.id, c.message_count) for c in m.Conversation.query))")
+    assert out == "[('a', 2), ('b', 0)]"
+    with sqlite3.connect(db_path) as conn:
+        indexes = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"ix_conv_user_updated", "ix_msg_conv_created"} <= indexes
+
+
+def test_title_is_only_set_when_empty(studio, conversation_id):
+    with studio.app.app_context():
+        studio.db.session.get(studio.Conversation, conversation_id).title = "first"
+        studio.db.session.commit()
+    user = {"conversation_id": conversation_id, "role": "user", "content": "q",
+            "model": None, "tokens_used": None, "created_at": datetime.utcnow()}
+    studio.submit_chat_turn(conversation_id, [user], title="second").result()
+    conversation, _ = _settled(studio, conversation_id)
+    assert conversation.title == "first"
+    assert conversation.message_count == 1
+
+
+def test_delete_waits_for_pending_turn(studio, client, conversation_id):
+    save = studio.save_chat_turn
+
+    def slow_save(*args, **kwargs):
+        time.sleep(0.3)
+        save(*args, **kwargs)
+
+    with mock.patch.object(studio, "save_chat_turn", slow_save), \
+            mock.patch.object(studio.session_requests, "post",
+                              return_value=_completion("answer")):
+        assert client.post("/chat", json={"conversation_id": conversation_id,
+                                          "message": "question"}).status_code == 200
+        with mock.patch.object(studio.logger, "error") as log_error:
+            assert client.delete(f"/conversations/{conversation_id}").status_code == 200
+            studio.wait_for_chat_turn(conversation_id)
+
+    log_error.assert_not_called()  # the turn was saved, not rejected by the foreign key
+    with studio.app.app_context():
+        assert studio.db.session.get(studio.Conversation, conversation_id) is None
+        assert studio.Message.query.filter_by(conversation_id=conversation_id).count() == 0
+
+
+def test_cleanup_deletes_only_expired_conversations(studio, conversation_id):
+    expired = datetime.utcnow() - timedelta(days=91)
+    with studio.app.app_context():
+        old = studio.Conversation(user_id="u", created_at=expired, updated_at=expired)
+        studio.db.session.add(old)
+        studio.db.session.flush()
+        studio.db.session.add_all([
+            studio.Message(conversation_id=old.id, role="user", content="q"),
+            studio.Message(conversation_id=conversation_id, role="user", content="q"),
+        ])
+        studio.db.session.commit()
+        # the ORM's onupdate would have bumped it on the message insert
+        studio.Conversation.query.filter_by(id=old.id).update(
+            {studio.Conversation.updated_at: expired}, synchronize_session=False)
+        studio.db.session.commit()
+        old_id = old.id
+
+        studio.cleanup_old_conversations()
+
+        assert studio.db.session.get(studio.Conversation, old_id) is None
+        assert studio.Message.query.filter_by(conversation_id=old_id).count() == 0
+        assert studio.db.session.get(studio.Conversation, conversation_id) is not None
+        assert studio.Message.query.filter_by(conversation_id=conversation_id).count() == 1
+
+
+def test_json_upload_parses_small_file(studio):
+    text = studio.process_file(io.BytesIO(b'{"a": [1, 2]}'), "data.json")
+    assert text == 'File: data.json\n{\n  "a": [\n    1,\n    2\n  ]\n}'
+
+
+def test_json_upload_keeps_raw_prefix_of_large_file(studio):
+    raw = b'{"values": [' + b",".join(b"1" for _ in range(studio.MAX_FILE_CONTENT)) + b"]}"
+    text = studio.process_file(io.BytesIO(raw), "big.json")
+    body = text[len("File: big.json\n"):]
+    assert body == raw[:studio.MAX_FILE_CONTENT].decode()
+
+
+def _csv(rows: int) -> bytes:
+    return ("x,y\n" + "".join(f"{i},{i * 2}\n" for i in range(rows))).encode()
+
+
+def test_count_table_rows_trusts_a_short_sample(studio):
+    # a sample shorter than the limit already reached the end - no second pass
+    assert studio.count_table_rows(io.BytesIO(b""), ".csv", 3) == 3
+
+
+def test_count_table_rows_counts_past_the_sample(studio, monkeypatch):
+    monkeypatch.setattr(studio, "TABLE_SAMPLE_ROWS", 5)
+    assert studio.count_table_rows(io.BytesIO(_csv(12)), ".csv", 5) == 12
+
+
+def test_count_table_rows_reads_xlsx_dimensions(studio, monkeypatch):
+    openpyxl = pytest.importorskip("openpyxl")
+    monkeypatch.setattr(studio, "TABLE_SAMPLE_ROWS", 5)
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(["x", "y"])
+    for i in range(12):
+        sheet.append([i, i * 2])
+    stream = io.BytesIO()
+    workbook.save(stream)
+    assert studio.count_table_rows(stream, ".xlsx", 5) == 12
+
+
+def test_csv_upload_summarises_a_bounded_sample(studio, monkeypatch):
+    pytest.importorskip("pandas")
+    monkeypatch.setattr(studio, "TABLE_SAMPLE_ROWS", 5)
+    text = studio.process_file(io.BytesIO(_csv(12)), "data.csv")
+    assert "Shape: 12 rows, 2 columns" in text
+    assert "Summary statistics (first 5 rows):" in text
+
+    text = studio.process_file(io.BytesIO(_csv(3)), "small.csv")
+    assert "Shape: 3 rows, 2 columns" in text
+    assert "Summary statistics:" in text